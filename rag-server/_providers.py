@@ -0,0 +1,86 @@
+"""Provider registry shared by the RAG server config (mirrors src/lib/ai/providers.ts)."""
+
+from collections import namedtuple
+from types import MappingProxyType
+
+ProviderDefault = namedtuple("ProviderDefault", "base_url default_model env_key")
+
+PROVIDER_DEFAULTS = MappingProxyType({
+    "openai": ProviderDefault(
+        base_url="https://api.openai.com/v1",
+        default_model="gpt-4o",
+        env_key="OPENAI_API_KEY",
+    ),
+    "anthropic": ProviderDefault(
+        base_url="https://api.anthropic.com/v1",
+        default_model="claude-sonnet-4-5-20250929",
+        env_key="ANTHROPIC_API_KEY",
+    ),
+    "google": ProviderDefault(
+        base_url="https://generativelanguage.googleapis.com/v1beta/openai",
+        default_model="gemini-2.5-pro",
+        env_key="GOOGLE_AI_API_KEY",
+    ),
+    "mistral": ProviderDefault(
+        base_url="https://api.mistral.ai/v1",
+        default_model="mistral-large-latest",
+        env_key="MISTRAL_API_KEY",
+    ),
+    "xai": ProviderDefault(
+        base_url="https://api.x.ai/v1",
+        default_model="grok-3",
+        env_key="XAI_API_KEY",
+    ),
+    "deepseek": ProviderDefault(
+        base_url="https://api.deepseek.com/v1",
+        default_model="deepseek-chat",
+        env_key="DEEPSEEK_API_KEY",
+    ),
+    "moonshot": ProviderDefault(
+        base_url="https://api.moonshot.cn/v1",
+        default_model="kimi-2.5",
+        env_key="MOONSHOT_API_KEY",
+    ),
+    "openrouter": ProviderDefault(
+        base_url="https://openrouter.ai/api/v1",
+        default_model="openai/gpt-4o",
+        env_key="OPENROUTER_API_KEY",
+    ),
+    "perplexity": ProviderDefault(
+        base_url="https://api.perplexity.ai",
+        default_model="sonar-pro",
+        env_key="PERPLEXITY_API_KEY",
+    ),
+    "ollama": ProviderDefault(
+        base_url="http://localhost:11434/v1",
+        default_model="llama3.1",
+        env_key="",
+    ),
+    "lmstudio": ProviderDefault(
+        base_url="http://localhost:1234/v1",
+        default_model="local-model",
+        env_key="",
+    ),
+    "minimax": ProviderDefault(
+        base_url="https://api.minimax.chat/v1",
+        default_model="MiniMax-M2.1",
+        env_key="MINIMAX_API_KEY",
+    ),
+    "glm": ProviderDefault(
+        base_url="https://open.bigmodel.cn/api/paas/v4",
+        default_model="glm-4-plus",
+        env_key="GLM_API_KEY",
+    ),
+    "huggingface": ProviderDefault(
+        base_url="https://api-inference.huggingface.co/v1",
+        default_model="meta-llama/Llama-3.1-70B-Instruct",
+        env_key="HUGGINGFACE_API_KEY",
+    ),
+    "vercel": ProviderDefault(
+        base_url="https://gateway.ai.vercel.app/v1",
+        default_model="openai/gpt-4o",
+        env_key="VERCEL_AI_GATEWAY_KEY",
+    ),
+})
+
+PROVIDER_KEYS: frozenset[str] = frozenset(PROVIDER_DEFAULTS)
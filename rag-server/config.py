@@ -1,207 +1,292 @@
+import atexit
+import hashlib
+import importlib.util
+import json
 import os
-import httpx
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+
 from dotenv import load_dotenv
 
-load_dotenv()
-
-# ─── Provider Registry (mirrors src/lib/ai/providers.ts) ────────
-
-PROVIDER_DEFAULTS = {
-    "openai": {
-        "base_url": "https://api.openai.com/v1",
-        "default_model": "gpt-4o",
-        "env_key": "OPENAI_API_KEY",
-    },
-    "anthropic": {
-        "base_url": "https://api.anthropic.com/v1",
-        "default_model": "claude-sonnet-4-5-20250929",
-        "env_key": "ANTHROPIC_API_KEY",
-    },
-    "google": {
-        "base_url": "https://generativelanguage.googleapis.com/v1beta/openai",
-        "default_model": "gemini-2.5-pro",
-        "env_key": "GOOGLE_AI_API_KEY",
-    },
-    "mistral": {
-        "base_url": "https://api.mistral.ai/v1",
-        "default_model": "mistral-large-latest",
-        "env_key": "MISTRAL_API_KEY",
-    },
-    "xai": {
-        "base_url": "https://api.x.ai/v1",
-        "default_model": "grok-3",
-        "env_key": "XAI_API_KEY",
-    },
-    "deepseek": {
-        "base_url": "https://api.deepseek.com/v1",
-        "default_model": "deepseek-chat",
-        "env_key": "DEEPSEEK_API_KEY",
-    },
-    "moonshot": {
-        "base_url": "https://api.moonshot.cn/v1",
-        "default_model": "kimi-2.5",
-        "env_key": "MOONSHOT_API_KEY",
-    },
-    "openrouter": {
-        "base_url": "https://openrouter.ai/api/v1",
-        "default_model": "openai/gpt-4o",
-        "env_key": "OPENROUTER_API_KEY",
-    },
-    "perplexity": {
-        "base_url": "https://api.perplexity.ai",
-        "default_model": "sonar-pro",
-        "env_key": "PERPLEXITY_API_KEY",
-    },
-    "ollama": {
-        "base_url": "http://localhost:11434/v1",
-        "default_model": "llama3.1",
-        "env_key": "",
-    },
-    "lmstudio": {
-        "base_url": "http://localhost:1234/v1",
-        "default_model": "local-model",
-        "env_key": "",
-    },
-    "minimax": {
-        "base_url": "https://api.minimax.chat/v1",
-        "default_model": "MiniMax-M2.1",
-        "env_key": "MINIMAX_API_KEY",
-    },
-    "glm": {
-        "base_url": "https://open.bigmodel.cn/api/paas/v4",
-        "default_model": "glm-4-plus",
-        "env_key": "GLM_API_KEY",
-    },
-    "huggingface": {
-        "base_url": "https://api-inference.huggingface.co/v1",
-        "default_model": "meta-llama/Llama-3.1-70B-Instruct",
-        "env_key": "HUGGINGFACE_API_KEY",
-    },
-    "vercel": {
-        "base_url": "https://gateway.ai.vercel.app/v1",
-        "default_model": "openai/gpt-4o",
-        "env_key": "VERCEL_AI_GATEWAY_KEY",
-    },
-}
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so workers fetch without coordinating
+    fcntl = None
+
+from _providers import PROVIDER_DEFAULTS, PROVIDER_KEYS
+
+# Containers get their env injected directly; SKIP_DOTENV=1 skips the .env search and parse
+if os.environ.get("SKIP_DOTENV") != "1":
+    load_dotenv()
+
+# Snapshot the environment once; plain dict reads skip os.environ's key/value codecs.
+ENV = dict(os.environ)
+
+# Storage
+WORKING_DIR = ENV.get("RAG_WORKING_DIR", "./rag_storage")
+
+# ─── Model Resolution ───────────────────────────────────────────
 
 
+@lru_cache(maxsize=128)
 def _parse_model_string(model_str: str) -> tuple[str, str]:
     """Parse 'provider/model' into (provider, model). Same logic as providers.ts."""
-    slash = model_str.find("/")
-    if slash > 0:
-        provider = model_str[:slash]
-        model = model_str[slash + 1:]
-        if provider in PROVIDER_DEFAULTS:
-            return provider, model
+    provider, sep, model = model_str.partition("/")
+    if sep and provider in PROVIDER_KEYS:
+        return provider, model
     return "openai", model_str
 
 
 def _resolve_from_env():
     """Resolve AI config from environment variables only."""
-    ai_provider = os.getenv("AI_PROVIDER", "openai")
-    ai_model = os.getenv("AI_MODEL", "")
+    ai_provider = ENV.get("AI_PROVIDER", "openai")
+    ai_model = ENV.get("AI_MODEL", "")
 
     if ai_model and "/" in ai_model:
         provider, model = _parse_model_string(ai_model)
+        defaults = PROVIDER_DEFAULTS.get(provider) or PROVIDER_DEFAULTS["openai"]
     else:
         provider = ai_provider
-        defaults = PROVIDER_DEFAULTS.get(provider, PROVIDER_DEFAULTS["openai"])
-        model = ai_model or defaults["default_model"]
+        defaults = PROVIDER_DEFAULTS.get(provider) or PROVIDER_DEFAULTS["openai"]
+        model = ai_model or defaults.default_model
 
-    defaults = PROVIDER_DEFAULTS.get(provider, PROVIDER_DEFAULTS["openai"])
-    env_key = defaults["env_key"]
-    api_key = os.getenv(env_key, "") if env_key else ""
-    base_url = os.getenv("OPENAI_BASE_URL", "") or defaults["base_url"]
+    env_key = defaults.env_key
+    api_key = ENV.get(env_key, "") if env_key else ""
+    base_url = ENV.get("OPENAI_BASE_URL", "") or defaults.base_url
 
-    embedding_provider = os.getenv("EMBEDDING_PROVIDER", "")
-    embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
-    embedding_api_key = os.getenv("EMBEDDING_API_KEY", "")
-    embedding_base_url = os.getenv("EMBEDDING_BASE_URL", "")
+    embedding_provider = ENV.get("EMBEDDING_PROVIDER", "")
+    embedding_model = ENV.get("EMBEDDING_MODEL", "text-embedding-3-small")
+    embedding_api_key = ENV.get("EMBEDDING_API_KEY", "")
+    embedding_base_url = ENV.get("EMBEDDING_BASE_URL", "")
 
     if embedding_provider and embedding_provider != provider:
-        emb_defaults = PROVIDER_DEFAULTS.get(embedding_provider, PROVIDER_DEFAULTS["openai"])
-        embedding_api_key = embedding_api_key or (os.getenv(emb_defaults["env_key"], "") if emb_defaults["env_key"] else "")
-        embedding_base_url = embedding_base_url or emb_defaults["base_url"]
+        emb_defaults = PROVIDER_DEFAULTS.get(embedding_provider) or PROVIDER_DEFAULTS["openai"]
+        embedding_api_key = embedding_api_key or (ENV.get(emb_defaults.env_key, "") if emb_defaults.env_key else "")
+        embedding_base_url = embedding_base_url or emb_defaults.base_url
     else:
         embedding_api_key = embedding_api_key or api_key
         embedding_base_url = embedding_base_url or base_url
 
-    return provider, model, api_key, base_url, embedding_model, embedding_api_key, embedding_base_url
+    return {
+        "ai_provider": provider,
+        "llm_model": model,
+        "llm_api_key": api_key,
+        "llm_base_url": base_url,
+        "embedding_model": embedding_model,
+        "embedding_api_key": embedding_api_key,
+        "embedding_base_url": embedding_base_url,
+    }
+
+
+# ─── Web App Settings ───────────────────────────────────────────
+
+# Shared across workers: fresh entries skip the HTTP call, stale ones (up to
+# CONFIG_CACHE_MAX_STALE old) are served when the web app is unreachable.
+CONFIG_CACHE_PATH = os.path.join(WORKING_DIR, ".effective_config.json")
+CONFIG_CACHE_TTL = 30  # seconds
+CONFIG_CACHE_MAX_STALE = int(ENV.get("RAG_CONFIG_CACHE_MAX_STALE", "3600"))  # seconds; 0 disables
+
+_http_client = None
+
+
+def _get_http_client(web_url):
+    """Lazily create a shared HTTP client so repeated fetches reuse connections."""
+    global _http_client
+    if _http_client is None:
+        import httpx  # deferred: only needed when the web app is consulted
+
+        # httpx only negotiates HTTP/2 over TLS (ALPN), and needs the optional h2 package
+        http2 = web_url.startswith("https://") and importlib.util.find_spec("h2") is not None
+        _http_client = httpx.Client(
+            http2=http2,
+            timeout=httpx.Timeout(5.0, connect=0.5, read=3.0),
+        )
+        atexit.register(_http_client.close)
+    return _http_client
+
+
+@contextmanager
+def _config_cache_lock():
+    """Hold an exclusive lock so only one worker fetches per TTL window."""
+    if fcntl is None:
+        yield
+        return
+    try:
+        os.makedirs(WORKING_DIR, exist_ok=True)
+        lock_file = open(f"{CONFIG_CACHE_PATH}.lock", "a")
+    except OSError:
+        yield  # storage not writable; fetch without coordinating
+        return
+    with lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except OSError:
+            pass  # e.g. ENOLCK on network mounts; fetch without coordinating
+        yield
+
+
+def _sha256(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _cache_source(web_url, rag_key):
+    """
+    Identify the web app, key and env-derived config a cached payload was fetched
+    under, so entries go unused once any of them changes. Only hashes are stored.
+    """
+    return {
+        "web_url": web_url,
+        "key_hash": _sha256(rag_key),
+        "env_hash": _sha256(json.dumps(_resolve_from_env(), sort_keys=True)),
+    }
+
+
+def _read_config_cache(source, max_age=None):
+    """
+    Return the cached config, or None if missing, unreadable, older than max_age,
+    or fetched under a different source (web app URL, API key or env config).
+    """
+    try:
+        if max_age is not None and time.time() - os.stat(CONFIG_CACHE_PATH).st_mtime > max_age:
+            return None
+        with open(CONFIG_CACHE_PATH, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get("source") != source:
+        return None
+    return entry.get("config")
+
+
+def _write_config_cache(source, config):
+    tmp_path = None
+    try:
+        # mkstemp creates the file 0600, which matters since the payload carries API keys
+        fd, tmp_path = tempfile.mkstemp(dir=WORKING_DIR, prefix=".effective_config.")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "config": config}, f)
+        os.replace(tmp_path, CONFIG_CACHE_PATH)
+    except OSError as e:
+        print(f"WARNING: Could not write config cache ({e})")
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
 
 
 def _fetch_from_web_app():
     """
     Fetch effective AI config from the Next.js web app's /api/settings/effective.
-    Returns None if the web app is unreachable.
+    Served from the on-disk cache while it is fresh, and from a stale copy if the
+    web app is unreachable. Returns None if neither is available.
     """
-    web_url = os.getenv("WEB_APP_URL", "http://web:3000")
-    rag_key = os.getenv("RAG_API_KEY", "")
-    try:
-        headers = {}
-        if rag_key:
-            headers["Authorization"] = f"Bearer {rag_key}"
-        resp = httpx.get(f"{web_url}/api/settings/effective", headers=headers, timeout=5)
-        if resp.status_code == 200:
-            return resp.json()
-    except Exception as e:
-        print(f"INFO: Could not fetch config from web app ({e}), using env vars")
-    return None
-
-
-def _resolve_config():
+    web_url = ENV.get("WEB_APP_URL", "http://web:3000")
+    rag_key = ENV.get("RAG_API_KEY", "")
+    source = _cache_source(web_url, rag_key)
+
+    with _config_cache_lock():
+        cached = _read_config_cache(source, max_age=CONFIG_CACHE_TTL)
+        if cached:
+            return cached
+
+        # Built outside the try so setup errors surface instead of reading as "unreachable"
+        client = _get_http_client(web_url)
+        try:
+            headers = {}
+            if rag_key:
+                headers["Authorization"] = f"Bearer {rag_key}"
+            resp = client.get(f"{web_url}/api/settings/effective", headers=headers)
+            if resp.status_code == 200:
+                config = resp.json()
+                _write_config_cache(source, config)
+                return config
+        except Exception as e:
+            print(f"INFO: Could not fetch config from web app ({e})")
+
+        stale = None
+        if CONFIG_CACHE_MAX_STALE > 0:
+            stale = _read_config_cache(source, max_age=CONFIG_CACHE_MAX_STALE)
+        if stale:
+            print("INFO: Using cached web app config")
+            return stale
+        print("INFO: No web app config available, using env vars")
+        return None
+
+
+def _resolve_from_remote(remote):
+    """Resolve AI config from the web app's effective settings payload."""
+    provider = remote.get("provider", "openai")
+    model = remote.get("model", "")
+    api_key = remote.get("apiKey", "")
+    base_url = remote.get("baseUrl", "")
+
+    defaults = PROVIDER_DEFAULTS.get(provider) or PROVIDER_DEFAULTS["openai"]
+    model = model or defaults.default_model
+    base_url = base_url or defaults.base_url
+
+    embedding_provider = remote.get("embeddingProvider", "")
+    embedding_model = remote.get("embeddingModel", "text-embedding-3-small")
+    embedding_api_key = remote.get("embeddingApiKey", "")
+    embedding_base_url = remote.get("embeddingBaseUrl", "")
+
+    if embedding_provider and embedding_provider != provider:
+        emb_defaults = PROVIDER_DEFAULTS.get(embedding_provider) or PROVIDER_DEFAULTS["openai"]
+        embedding_api_key = embedding_api_key or (ENV.get(emb_defaults.env_key, "") if emb_defaults.env_key else "")
+        embedding_base_url = embedding_base_url or emb_defaults.base_url
+    else:
+        embedding_api_key = embedding_api_key or api_key
+        embedding_base_url = embedding_base_url or base_url
+
+    return {
+        "ai_provider": provider,
+        "llm_model": model,
+        "llm_api_key": api_key,
+        "llm_base_url": base_url,
+        "embedding_model": embedding_model,
+        "embedding_api_key": embedding_api_key,
+        "embedding_base_url": embedding_base_url,
+    }
+
+
+# ─── Resolved Configuration ─────────────────────────────────────
+
+
+@dataclass(slots=True, frozen=True)
+class Settings:
+    """Resolved RAG server configuration. API keys are left out of repr."""
+
+    # AI
+    ai_provider: str
+    llm_model: str
+    llm_api_key: str = field(repr=False)
+    llm_base_url: str
+    embedding_model: str
+    embedding_api_key: str = field(repr=False)
+    embedding_base_url: str
+    embedding_dim: int
+    # Server
+    host: str
+    port: int
+    api_key: str = field(repr=False)
+    # Storage
+    working_dir: str
+
+
+def _resolve_config() -> Settings:
     """
     Resolve AI config: try web app DB settings first, fall back to env vars.
     """
     remote = _fetch_from_web_app()
-    if remote:
-        provider = remote.get("provider", "openai")
-        model = remote.get("model", "")
-        api_key = remote.get("apiKey", "")
-        base_url = remote.get("baseUrl", "")
-
-        if not model:
-            defaults = PROVIDER_DEFAULTS.get(provider, PROVIDER_DEFAULTS["openai"])
-            model = defaults["default_model"]
-        if not base_url:
-            defaults = PROVIDER_DEFAULTS.get(provider, PROVIDER_DEFAULTS["openai"])
-            base_url = defaults["base_url"]
-
-        embedding_provider = remote.get("embeddingProvider", "")
-        embedding_model = remote.get("embeddingModel", "text-embedding-3-small")
-        embedding_api_key = remote.get("embeddingApiKey", "")
-        embedding_base_url = remote.get("embeddingBaseUrl", "")
-
-        if embedding_provider and embedding_provider != provider:
-            emb_defaults = PROVIDER_DEFAULTS.get(embedding_provider, PROVIDER_DEFAULTS["openai"])
-            embedding_api_key = embedding_api_key or (os.getenv(emb_defaults["env_key"], "") if emb_defaults["env_key"] else "")
-            embedding_base_url = embedding_base_url or emb_defaults["base_url"]
-        else:
-            embedding_api_key = embedding_api_key or api_key
-            embedding_base_url = embedding_base_url or base_url
-
-        return provider, model, api_key, base_url, embedding_model, embedding_api_key, embedding_base_url
-
-    return _resolve_from_env()
-
-
-# ─── Resolved AI Configuration ──────────────────────────────────
-
-(
-    AI_PROVIDER,
-    LLM_MODEL,
-    LLM_API_KEY,
-    LLM_BASE_URL,
-    EMBEDDING_MODEL,
-    EMBEDDING_API_KEY,
-    EMBEDDING_BASE_URL,
-) = _resolve_config()
-
-EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
-
-# Server Configuration
-HOST = os.getenv("RAG_HOST", "0.0.0.0")
-PORT = int(os.getenv("RAG_PORT", "8020"))
-API_KEY = os.getenv("RAG_API_KEY", "")
+    ai = _resolve_from_remote(remote) if remote else _resolve_from_env()
+    return Settings(
+        **ai,
+        embedding_dim=int(ENV.get("EMBEDDING_DIM", "1536")),
+        host=ENV.get("RAG_HOST", "0.0.0.0"),
+        port=int(ENV.get("RAG_PORT", "8020")),
+        api_key=ENV.get("RAG_API_KEY", ""),
+        working_dir=WORKING_DIR,
+    )
 
-# Storage
-WORKING_DIR = os.getenv("RAG_WORKING_DIR", "./rag_storage")
+
+CONFIG = _resolve_config()
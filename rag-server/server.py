@@ -5,36 +5,44 @@ Handles document ingestion, memory storage, and intelligent retrieval.
 """
 
 import asyncio
+import hmac
 import json
 import os
 import uuid
 from contextlib import asynccontextmanager
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Literal, Optional
 
-import uvicorn
 from fastapi import FastAPI, HTTPException, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
-from config import (
-    AI_PROVIDER,
-    LLM_MODEL,
-    LLM_API_KEY,
-    LLM_BASE_URL,
-    EMBEDDING_MODEL,
-    EMBEDDING_DIM,
-    EMBEDDING_API_KEY,
-    EMBEDDING_BASE_URL,
-    HOST,
-    PORT,
-    API_KEY,
-    WORKING_DIR,
-)
+from config import CONFIG
+
+try:
+    from lightrag import QueryParam
+except ImportError:
+    QueryParam = None  # mock mode: get_rag() returns None, so handlers never reach it
+
+_UTC = timezone.utc
+
+
+# Fixed-detail errors are built fresh per raise: a shared instance would keep
+# the last failing request's traceback (and its frames) alive.
+def _rag_unavailable() -> HTTPException:
+    return HTTPException(status_code=503, detail="RAG engine not available")
+
+
+def _invalid_api_key() -> HTTPException:
+    return HTTPException(status_code=401, detail="Invalid API key")
+
 
 # ─── LightRAG Setup ──────────────────────────────────────────
 
+# Initialized by lifespan; endpoints read it directly and only call
+# get_rag() while it is still unset (e.g. mock mode or a failed startup).
 rag_instance = None
+_rag_init_lock = asyncio.Lock()
 
 
 async def get_rag():
@@ -43,44 +51,50 @@ async def get_rag():
     if rag_instance is not None:
         return rag_instance
 
-    try:
-        from functools import partial
-        from lightrag import LightRAG, QueryParam
-        from lightrag.llm.openai import openai_complete, openai_embed
-        from lightrag.utils import EmbeddingFunc
-
-        os.makedirs(WORKING_DIR, exist_ok=True)
-
-        rag_instance = LightRAG(
-            working_dir=WORKING_DIR,
-            llm_model_func=openai_complete,
-            llm_model_name=LLM_MODEL,
-            llm_model_kwargs={
-                "api_key": LLM_API_KEY,
-                "base_url": LLM_BASE_URL,
-            },
-            embedding_func=EmbeddingFunc(
-                embedding_dim=EMBEDDING_DIM,
-                func=partial(
-                    openai_embed.func,
-                    model=EMBEDDING_MODEL,
-                    api_key=EMBEDDING_API_KEY,
-                    base_url=EMBEDDING_BASE_URL,
+    async with _rag_init_lock:
+        # Another request may have finished init while we waited
+        if rag_instance is not None:
+            return rag_instance
+
+        try:
+            from functools import partial
+            from lightrag import LightRAG
+            from lightrag.llm.openai import openai_complete, openai_embed
+            from lightrag.utils import EmbeddingFunc
+
+            os.makedirs(CONFIG.working_dir, exist_ok=True)
+
+            rag_instance = LightRAG(
+                working_dir=CONFIG.working_dir,
+                llm_model_func=openai_complete,
+                llm_model_name=CONFIG.llm_model,
+                llm_model_kwargs={
+                    "api_key": CONFIG.llm_api_key,
+                    "base_url": CONFIG.llm_base_url,
+                },
+                embedding_func=EmbeddingFunc(
+                    embedding_dim=CONFIG.embedding_dim,
+                    func=partial(
+                        openai_embed.func,
+                        model=CONFIG.embedding_model,
+                        api_key=CONFIG.embedding_api_key,
+                        base_url=CONFIG.embedding_base_url,
+                    ),
                 ),
-            ),
-        )
-        return rag_instance
-    except ImportError:
-        print(
-            "WARNING: LightRAG not installed. Running in mock mode. "
-            "Install with: pip install lightrag-hku"
-        )
-        return None
+            )
+            return rag_instance
+        except ImportError:
+            print(
+                "WARNING: LightRAG not installed. Running in mock mode. "
+                "Install with: pip install lightrag-hku"
+            )
+            return None
 
 
 # ─── RAG-Anything Setup ──────────────────────────────────────
 
 rag_anything_instance = None
+_rag_anything_init_lock = asyncio.Lock()
 
 
 async def get_rag_anything():
@@ -89,23 +103,30 @@ async def get_rag_anything():
     if rag_anything_instance is not None:
         return rag_anything_instance
 
-    try:
-        from raganything import RAGAnything
+    async with _rag_anything_init_lock:
+        if rag_anything_instance is not None:
+            return rag_anything_instance
 
-        rag_anything_instance = RAGAnything(
-            lightrag=await get_rag(),
-        )
-        return rag_anything_instance
-    except ImportError:
-        print(
-            "WARNING: RAG-Anything not installed. Multimodal features disabled. "
-            "Install with: pip install raganything"
-        )
-        return None
+        try:
+            from raganything import RAGAnything
+
+            rag_anything_instance = RAGAnything(
+                lightrag=await get_rag(),
+            )
+            return rag_anything_instance
+        except ImportError:
+            print(
+                "WARNING: RAG-Anything not installed. Multimodal features disabled. "
+                "Install with: pip install raganything"
+            )
+            return None
 
 
 # ─── API Models ───────────────────────────────────────────────
 
+QueryMode = Literal["local", "global", "hybrid", "naive", "mix"]
+MemoryType = Literal["short_term", "long_term", "episodic"]
+
 
 class IngestRequest(BaseModel):
     content: str
@@ -121,7 +142,7 @@ class IngestFileRequest(BaseModel):
 
 class QueryRequest(BaseModel):
     query: str
-    mode: str = Field(default="hybrid", pattern="^(local|global|hybrid|naive|mix)$")
+    mode: QueryMode = "hybrid"
     top_k: int = Field(default=5, ge=1, le=50)
     user_id: Optional[str] = None
 
@@ -129,9 +150,7 @@ class QueryRequest(BaseModel):
 class MemoryStoreRequest(BaseModel):
     user_id: str
     content: str
-    memory_type: str = Field(
-        default="long_term", pattern="^(short_term|long_term|episodic)$"
-    )
+    memory_type: MemoryType = "long_term"
     tags: Optional[list[str]] = None
     metadata: Optional[dict] = None
 
@@ -147,14 +166,72 @@ class DeleteRequest(BaseModel):
     doc_ids: list[str]
 
 
+# Response models (mirror src/lib/rag/types.ts). Declaring them as return types
+# lets FastAPI serialize responses straight to JSON through Pydantic.
+
+
+class HealthResponse(BaseModel):
+    status: str
+    lightrag: bool
+    rag_anything: bool
+
+
+class IngestResponse(BaseModel):
+    status: str
+    doc_id: str
+
+
+class IngestFileResponse(BaseModel):
+    status: str
+    doc_id: str
+    mode: Literal["text_only", "multimodal"]
+
+
+class QueryResponse(BaseModel):
+    status: str
+    result: str
+    mode: QueryMode
+
+
+class MemoryStoreResponse(BaseModel):
+    status: str
+    doc_id: str
+    memory_type: MemoryType
+    timestamp: str
+
+
+class MemoryQueryResponse(BaseModel):
+    status: str
+    memories: str
+    query: str
+    user_id: str
+
+
+class DeleteResponse(BaseModel):
+    status: str
+    deleted: list[str]
+
+
+class GraphStatsResponse(BaseModel):
+    status: str
+    working_dir: str
+    provider: str
+    model: str
+    embedding_model: str
+
+
 # ─── Auth Dependency ─────────────────────────────────────────
 
 
+# Compared as bytes: compare_digest rejects non-ASCII str, and header values may contain it
+_EXPECTED_AUTH = f"Bearer {CONFIG.api_key}".encode() if CONFIG.api_key else None
+
+
 async def verify_api_key(authorization: Optional[str] = Header(None)):
-    if not API_KEY:
-        return  # No auth required if API_KEY not set
-    if not authorization or authorization != f"Bearer {API_KEY}":
-        raise HTTPException(status_code=401, detail="Invalid API key")
+    if _EXPECTED_AUTH is None:
+        return  # No auth required if RAG_API_KEY not set
+    if not authorization or not hmac.compare_digest(authorization.encode(), _EXPECTED_AUTH):
+        raise _invalid_api_key()
 
 
 # ─── App Setup ────────────────────────────────────────────────
@@ -188,8 +265,9 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
 
 
@@ -197,7 +275,7 @@ app.add_middleware(
 
 
 @app.get("/health")
-async def health():
+async def health() -> HealthResponse:
     return {
         "status": "ok",
         "lightrag": rag_instance is not None,
@@ -209,19 +287,19 @@ async def health():
 
 
 @app.post("/ingest", dependencies=[Depends(verify_api_key)])
-async def ingest_text(req: IngestRequest):
+async def ingest_text(req: IngestRequest) -> IngestResponse:
     """Ingest text content into the RAG knowledge graph."""
-    rag = await get_rag()
+    rag = rag_instance or await get_rag()
     if not rag:
-        raise HTTPException(status_code=503, detail="RAG engine not available")
+        raise _rag_unavailable()
 
-    doc_id = req.doc_id or str(uuid.uuid4())
+    doc_id = req.doc_id or uuid.uuid4().hex
 
     try:
         # Prepend metadata as context if provided
         content = req.content
         if req.metadata:
-            meta_str = "\n".join(f"{k}: {v}" for k, v in req.metadata.items())
+            meta_str = "\n".join(map("{}: {}".format, req.metadata.keys(), req.metadata.values()))
             content = f"[Document ID: {doc_id}]\n[Metadata]\n{meta_str}\n\n{content}"
 
         await rag.ainsert(content)
@@ -230,25 +308,29 @@ async def ingest_text(req: IngestRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
 @app.post("/ingest/file", dependencies=[Depends(verify_api_key)])
-async def ingest_file(req: IngestFileRequest):
+async def ingest_file(req: IngestFileRequest) -> IngestFileResponse:
     """Ingest a file using RAG-Anything for multimodal processing."""
-    rag_any = await get_rag_anything()
+    rag_any = rag_anything_instance or await get_rag_anything()
     if not rag_any:
         # Fallback to text-only ingestion
-        rag = await get_rag()
+        rag = rag_instance or await get_rag()
         if not rag:
-            raise HTTPException(status_code=503, detail="RAG engine not available")
+            raise _rag_unavailable()
 
         try:
-            with open(req.file_path, "r") as f:
-                content = f.read()
+            content = await asyncio.to_thread(_read_text, req.file_path)
             await rag.ainsert(content)
-            return {"status": "ok", "doc_id": req.doc_id or str(uuid.uuid4()), "mode": "text_only"}
+            return {"status": "ok", "doc_id": req.doc_id or uuid.uuid4().hex, "mode": "text_only"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    doc_id = req.doc_id or str(uuid.uuid4())
+    doc_id = req.doc_id or uuid.uuid4().hex
 
     try:
         await rag_any.process_document(
@@ -264,15 +346,13 @@ async def ingest_file(req: IngestFileRequest):
 
 
 @app.post("/query", dependencies=[Depends(verify_api_key)])
-async def query(req: QueryRequest):
+async def query(req: QueryRequest) -> QueryResponse:
     """Query the RAG knowledge graph."""
-    rag = await get_rag()
+    rag = rag_instance or await get_rag()
     if not rag:
-        raise HTTPException(status_code=503, detail="RAG engine not available")
+        raise _rag_unavailable()
 
     try:
-        from lightrag import QueryParam
-
         # Build query with user context if provided
         query_text = req.query
         if req.user_id:
@@ -296,30 +376,29 @@ async def query(req: QueryRequest):
 
 
 @app.post("/memory/store", dependencies=[Depends(verify_api_key)])
-async def store_memory(req: MemoryStoreRequest):
+async def store_memory(req: MemoryStoreRequest) -> MemoryStoreResponse:
     """Store a memory entry into the RAG system with user-scoped context."""
-    rag = await get_rag()
+    rag = rag_instance or await get_rag()
     if not rag:
-        raise HTTPException(status_code=503, detail="RAG engine not available")
+        raise _rag_unavailable()
 
-    doc_id = str(uuid.uuid4())
-    timestamp = datetime.utcnow().isoformat()
+    doc_id = uuid.uuid4().hex
+    timestamp = datetime.now(_UTC).isoformat(timespec="milliseconds")
 
     try:
         # Format memory with structured metadata for the knowledge graph
-        memory_doc = (
-            f"[Memory Entry: {doc_id}]\n"
-            f"[User: {req.user_id}]\n"
-            f"[Type: {req.memory_type}]\n"
-            f"[Timestamp: {timestamp}]\n"
-        )
+        parts: list[str] = [
+            f"[Memory Entry: {doc_id}]",
+            f"[User: {req.user_id}]",
+            f"[Type: {req.memory_type}]",
+            f"[Timestamp: {timestamp}]",
+        ]
         if req.tags:
-            memory_doc += f"[Tags: {', '.join(req.tags)}]\n"
+            parts.append(f"[Tags: {', '.join(req.tags)}]")
         if req.metadata:
-            meta_str = "\n".join(f"[{k}: {v}]" for k, v in req.metadata.items())
-            memory_doc += f"{meta_str}\n"
+            parts.extend(map("[{}: {}]".format, req.metadata.keys(), req.metadata.values()))
 
-        memory_doc += f"\n{req.content}"
+        memory_doc = "\n".join(parts) + "\n\n" + req.content
 
         await rag.ainsert(memory_doc)
 
@@ -334,15 +413,13 @@ async def store_memory(req: MemoryStoreRequest):
 
 
 @app.post("/memory/query", dependencies=[Depends(verify_api_key)])
-async def query_memory(req: MemoryQueryRequest):
+async def query_memory(req: MemoryQueryRequest) -> MemoryQueryResponse:
     """Query memories for a specific user."""
-    rag = await get_rag()
+    rag = rag_instance or await get_rag()
     if not rag:
-        raise HTTPException(status_code=503, detail="RAG engine not available")
+        raise _rag_unavailable()
 
     try:
-        from lightrag import QueryParam
-
         # Scope query to user
         scoped_query = f"[User: {req.user_id}]"
         if req.memory_type:
@@ -368,11 +445,11 @@ async def query_memory(req: MemoryQueryRequest):
 
 
 @app.post("/delete", dependencies=[Depends(verify_api_key)])
-async def delete_documents(req: DeleteRequest):
+async def delete_documents(req: DeleteRequest) -> DeleteResponse:
     """Delete documents from the RAG store."""
-    rag = await get_rag()
+    rag = rag_instance or await get_rag()
     if not rag:
-        raise HTTPException(status_code=503, detail="RAG engine not available")
+        raise _rag_unavailable()
 
     try:
         await rag.adelete_by_doc_id(req.doc_ids)
@@ -385,20 +462,20 @@ async def delete_documents(req: DeleteRequest):
 
 
 @app.get("/graph/stats", dependencies=[Depends(verify_api_key)])
-async def graph_stats():
+async def graph_stats() -> GraphStatsResponse:
     """Get knowledge graph statistics."""
-    rag = await get_rag()
+    rag = rag_instance or await get_rag()
     if not rag:
-        raise HTTPException(status_code=503, detail="RAG engine not available")
+        raise _rag_unavailable()
 
     try:
         # Get basic stats from the knowledge graph
         return {
             "status": "ok",
-            "working_dir": WORKING_DIR,
-            "provider": AI_PROVIDER,
-            "model": LLM_MODEL,
-            "embedding_model": EMBEDDING_MODEL,
+            "working_dir": CONFIG.working_dir,
+            "provider": CONFIG.ai_provider,
+            "model": CONFIG.llm_model,
+            "embedding_model": CONFIG.embedding_model,
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -407,5 +484,14 @@ async def graph_stats():
 # ─── Main ─────────────────────────────────────────────────────
 
 if __name__ == "__main__":
-    print(f"Starting OpenAssistant RAG Server on {HOST}:{PORT}")
-    uvicorn.run(app, host=HOST, port=PORT)
+    import uvicorn
+
+    print(f"Starting OpenAssistant RAG Server on {CONFIG.host}:{CONFIG.port}")
+    uvicorn.run(
+        app,
+        host=CONFIG.host,
+        port=CONFIG.port,
+        loop="auto",  # uvloop where installed (not available on Windows)
+        http="httptools",
+        access_log=False,
+    )